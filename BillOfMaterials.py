@@ -0,0 +1,120 @@
+import argparse
+import csv
+import json
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from Schematic import Schematic
+from SchematicDiscovery import DEFAULT_INCLUDE, discover_schem_files, worker_context
+
+
+def count_file(path: str) -> tuple[str, dict[str, int] | None, str | None]:
+    """Map step: block state counts of one file, or the error that prevented reading it."""
+    try:
+        return path, Schematic.from_file(path).block_counts(), None
+    except Exception as e:
+        return path, None, str(e)
+
+
+def base_name(block: str) -> str:
+    return re.sub(r"\[.*?\]", "", block)
+
+
+def rollup_base_names(counts: Counter) -> Counter:
+    """Sum block states with different properties (e.g. every oak_log axis) under their base name."""
+    rolled_up = Counter()
+    for block, count in counts.items():
+        rolled_up[base_name(block)] += count
+    return rolled_up
+
+
+class BillOfMaterials:
+    """Reduce step: pack-wide and per-folder block counts, folders relative to the scanned root."""
+
+    def __init__(self, root_path: str):
+        self.root_path = root_path
+        self.total = Counter()
+        self.folders: dict[str, Counter] = {}
+        self.num_files = 0
+        self.errors: dict[str, str] = {}
+
+    def add(self, path: str, counts: dict[str, int]) -> None:
+        folder = os.path.relpath(os.path.dirname(path), self.root_path)
+        self.total.update(counts)
+        self.folders.setdefault(folder, Counter()).update(counts)
+        self.num_files += 1
+
+    def rolled_up(self) -> "BillOfMaterials":
+        bill = BillOfMaterials(self.root_path)
+        bill.total = rollup_base_names(self.total)
+        bill.folders = {folder: rollup_base_names(counts) for folder, counts in self.folders.items()}
+        bill.num_files = self.num_files
+        bill.errors = self.errors
+        return bill
+
+    def save_csv(self, filepath: str) -> None:
+        """One row per folder and block, plus the pack total with folder '*'."""
+        with open(filepath, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["folder", "block", "count"])
+            for block, count in self.total.most_common():
+                writer.writerow(["*", block, count])
+            for folder in sorted(self.folders):
+                for block, count in self.folders[folder].most_common():
+                    writer.writerow([folder, block, count])
+
+    def save_json(self, filepath: str) -> None:
+        with open(filepath, "w", encoding="utf-8") as f:
+            json.dump({
+                "files": self.num_files,
+                "total": dict(self.total.most_common()),
+                "folders": {folder: dict(self.folders[folder].most_common()) for folder in sorted(self.folders)},
+                "errors": self.errors,
+            }, f, indent=2)
+
+
+def count_pack(root_path: str, workers: int | None = None, include=DEFAULT_INCLUDE, exclude=(),
+               max_depth: int | None = None) -> BillOfMaterials:
+    """Count the blocks of every .schem file below root_path in parallel worker processes."""
+    bill = BillOfMaterials(root_path)
+    # map submits files to the workers as they are discovered
+    files = discover_schem_files(root_path, include, exclude, max_depth)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=worker_context()) as executor:
+        for path, counts, error in executor.map(count_file, files, chunksize=16):
+            if error is not None:
+                print(f"An error occurred while processing {path}: {error}", flush=True)
+                bill.errors[path] = error
+            else:
+                bill.add(path, counts)
+    return bill
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count every block state across a pack of schematics.")
+    parser.add_argument("folder", help="folder with .schem files, including subfolders")
+    parser.add_argument("--csv", help="write per-folder and total counts to this CSV file")
+    parser.add_argument("--json", help="write per-folder and total counts to this JSON file")
+    parser.add_argument("--base-names", action="store_true", help="sum block states under their base block name")
+    parser.add_argument("--workers", type=int, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--include", action="append", help="glob for files to count, repeatable (default: *.schem)")
+    parser.add_argument("--exclude", action="append", default=[], help="glob for files or folders to skip, repeatable")
+    parser.add_argument("--max-depth", type=int, help="how many folders deep to search (0: only the folder itself)")
+    args = parser.parse_args()
+
+    bill = count_pack(args.folder, args.workers, args.include or DEFAULT_INCLUDE, args.exclude, args.max_depth)
+    if args.base_names:
+        bill = bill.rolled_up()
+    if args.csv:
+        bill.save_csv(args.csv)
+    if args.json:
+        bill.save_json(args.json)
+
+    print(f"{bill.num_files} files, {len(bill.total)} different blocks, {sum(bill.total.values())} blocks in total")
+    for block, count in bill.total.most_common(20):
+        print(f"{count:>12}  {block}")
+
+
+if __name__ == "__main__":
+    main()
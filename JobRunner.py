@@ -0,0 +1,231 @@
+import argparse
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Iterator
+
+from PIL import Image
+
+from CombineImages import combine_images_grid
+from MappingRules import WeightedTargets, compile_mappings, load_mapping_file
+from SchemBlockReplacer import RANDOM_SEED, apply_mappings
+from Schematic import Schematic
+from SchematicDiscovery import DEFAULT_INCLUDE, SchematicFinder, worker_context
+from SchematicPreview import (CONTACT_SHEET, DEFAULT_IMAGE_FORMAT, DEFAULT_PREVIEW_VIEW, IMAGE_FORMATS, PREVIEW_VIEWS,
+                              ProjectionRenderer, image_filename, render_preview, resize_to_height, save_image)
+from SchematicStream import STREAMING_FILE_SIZE, read_header, stream_variants
+
+
+def load_manifest(manifest_path: str) -> dict:
+    """
+    A job manifest (.json or .toml) describes several variants of a pack, paths are relative to the manifest:
+
+    {
+        "inputs": ["packs/medieval"],
+        "previews": "out/previews",
+        "workers": 4,
+        "seed": 0,
+        "presets": [
+            {"name": "desert", "mappings": "presets/desert.txt", "output": "out/desert", "previews": "out/desert_previews"},
+            {"name": "snow", "mappings": {"minecraft:grass_block": "minecraft:snow_block"}, "output": "out/snow"}
+        ]
+    }
+
+    Optional "include" and "exclude" globs and "max_depth" select the files (see SchematicDiscovery.SchematicFinder),
+    "image_format" is one of SchematicPreview.IMAGE_FORMATS and "view" one of SchematicPreview.PREVIEW_VIEWS.
+    "previews" (top level) renders the unmodified schematics, "mappings" is a file saved with "Save settings" or an
+    inline block -> replacement table. Every source file is decoded once and all presets are applied to copies of it.
+    """
+    if manifest_path.lower().endswith(".toml"):
+        import tomllib
+        with open(manifest_path, "rb") as f:
+            manifest = tomllib.load(f)
+    else:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+
+    def resolve(path: str | None) -> str | None:
+        return os.path.join(base_dir, path) if path else None
+
+    if not manifest.get("inputs"):
+        raise ValueError("The manifest needs at least one entry in 'inputs'")
+    manifest["inputs"] = [resolve(path) for path in manifest["inputs"]]
+    manifest["previews"] = resolve(manifest.get("previews"))
+    manifest.setdefault("image_format", DEFAULT_IMAGE_FORMAT)
+    if manifest["image_format"] not in IMAGE_FORMATS:
+        raise ValueError(f"Unknown image_format '{manifest['image_format']}', expected one of {', '.join(IMAGE_FORMATS)}")
+    manifest.setdefault("view", DEFAULT_PREVIEW_VIEW)
+    if manifest["view"] not in PREVIEW_VIEWS:
+        raise ValueError(f"Unknown view '{manifest['view']}', expected one of {', '.join(PREVIEW_VIEWS)}")
+    presets = []
+    for index, preset in enumerate(manifest.get("presets", [])):
+        name = preset.get("name", f"preset{index + 1}")
+        if not preset.get("output"):
+            raise ValueError(f"Preset {name} has no 'output'")
+        mappings = preset.get("mappings", {})
+        if isinstance(mappings, str):
+            mappings = load_mapping_file(resolve(mappings))
+        presets.append({
+            "name": name,
+            "mappings": compile_mappings(mappings),
+            "output": resolve(preset["output"]),
+            "previews": resolve(preset.get("previews")),
+        })
+    manifest["presets"] = presets
+    return manifest
+
+
+def only_renames(mappings: dict) -> bool:
+    """True if the compiled mappings only rename palette entries and never touch the voxels."""
+    return all(region is None and not isinstance(replacement, WeightedTargets)
+               for replacement, region in mappings.values())
+
+
+def find_jobs(manifest: dict) -> Iterator[tuple[str, str]]:
+    """
+    (file path, output path relative to every preset's output folder) for all schematic files of all inputs,
+    generated while the inputs are searched, so the first files are processed before the search has finished.
+    """
+    inputs = manifest["inputs"]
+    finder = SchematicFinder(manifest.get("include", DEFAULT_INCLUDE), manifest.get("exclude", ()),
+                             manifest.get("max_depth"))
+    for input_root in inputs:
+        prefix = os.path.basename(os.path.normpath(input_root)) if len(inputs) > 1 else ""
+        for path in finder.discover(input_root):
+            yield path, os.path.join(prefix, os.path.relpath(path, input_root))
+
+
+def save_preview(img: Image.Image, preview_dir: str, relative_path: str) -> str:
+    image_format = _worker_manifest["image_format"]
+    preview_file = os.path.join(preview_dir, image_filename(relative_path, image_format))
+    save_image(resize_to_height(img, 200), preview_file, image_format)
+    return preview_file
+
+
+_worker_manifest = None
+
+
+def init_worker(manifest: dict) -> None:
+    """Runs once per worker process, so presets are compiled and sent once instead of with every file."""
+    global _worker_manifest
+    _worker_manifest = manifest
+
+
+def run_job(path: str, relative_path: str) -> tuple[list[str], dict[str, str]]:
+    """Decode one schematic and write every preset output and preview from it. Returns log lines and previews."""
+    manifest = _worker_manifest
+    seed = manifest.get("seed", RANDOM_SEED)
+    log = [f"Processing {path}..."]
+    previews = {}
+
+    if os.path.getsize(path) > STREAMING_FILE_SIZE:
+        return run_streamed_job(path, relative_path)
+
+    schem = Schematic.from_file(path)
+    if manifest["previews"]:
+        previews[manifest["previews"]] = save_preview(render_preview(schem, manifest["view"]), manifest["previews"],
+                                                      relative_path)
+
+    for preset in manifest["presets"]:
+        variant = schem.copy(share_blocks=only_renames(preset["mappings"]))
+        for message in apply_mappings(variant, preset["mappings"], seed=seed):
+            log.append(f"  {preset['name']}: {message}")
+        output_file = os.path.join(preset["output"], relative_path)
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        variant.to_file(output_file)
+        if preset["previews"]:
+            previews[preset["previews"]] = save_preview(render_preview(variant, manifest["view"]), preset["previews"],
+                                                        relative_path)
+    return log, previews
+
+
+def run_streamed_job(path: str, relative_path: str) -> tuple[list[str], dict[str, str]]:
+    """
+    run_job for files too large to decode as a whole: the file is still decoded once, slab by slab, and every
+    slab goes to the original preview and to a copy per preset with its own spool and preview renderer.
+    """
+    manifest = _worker_manifest
+    seed = manifest.get("seed", RANDOM_SEED)
+    log = [f"Processing {path} (streamed)..."]
+    previews = {}
+
+    header = read_header(path)
+
+    def new_renderer(preview_dir: str | None) -> ProjectionRenderer | None:
+        return ProjectionRenderer(header.width, header.height, header.length) if preview_dir else None
+
+    renderer = new_renderer(manifest["previews"])
+    preset_renderers = [new_renderer(preset["previews"]) for preset in manifest["presets"]]
+    variants = []
+    for preset, preset_renderer in zip(manifest["presets"], preset_renderers):
+        output_file = os.path.join(preset["output"], relative_path)
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        variants.append((preset["mappings"], output_file, preset_renderer.add_slab if preset_renderer else None))
+
+    messages = stream_variants(path, header, variants, seed, on_slab=renderer.add_slab if renderer else None)
+
+    if renderer:
+        previews[manifest["previews"]] = save_preview(renderer.image(), manifest["previews"], relative_path)
+    for preset, preset_renderer, preset_messages in zip(manifest["presets"], preset_renderers, messages):
+        log.extend(f"  {preset['name']}: {message}" for message in preset_messages)
+        if preset_renderer:
+            previews[preset["previews"]] = save_preview(preset_renderer.image(), preset["previews"], relative_path)
+    return log, previews
+
+
+def run_manifest(manifest_path: str) -> None:
+    manifest = load_manifest(manifest_path)
+    preview_dirs = [manifest["previews"]] + [preset["previews"] for preset in manifest["presets"]]
+    preview_dirs = [preview_dir for preview_dir in preview_dirs if preview_dir]
+    for preview_dir in preview_dirs:
+        os.makedirs(preview_dir, exist_ok=True)
+
+    workers = manifest.get("workers") or os.cpu_count() or 1
+    print(f"{len(manifest['presets'])} presets, {workers} workers\n", flush=True)
+
+    previews: dict[str, list[str]] = {preview_dir: [] for preview_dir in preview_dirs}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=worker_context(), initializer=init_worker,
+                             initargs=(manifest,)) as executor:
+        # keep at most two files per worker in flight, so memory stays bounded however large the pack is
+        pending = {}
+        num_jobs = 0
+        jobs_left = find_jobs(manifest)
+        while True:
+            for path, relative_path in jobs_left:
+                num_jobs += 1
+                pending[executor.submit(run_job, path, relative_path)] = path
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                try:
+                    log, job_previews = future.result()
+                except Exception as e:
+                    print(f"An error occurred while processing {path}: {e}\n", flush=True)
+                    continue
+                print("\n".join(log) + "\n", flush=True)
+                for preview_dir, preview_file in job_previews.items():
+                    previews[preview_dir].append(preview_file)
+
+    print(f"Processed {num_jobs} schematic files", flush=True)
+    for preview_dir, preview_files in previews.items():
+        if preview_files:
+            contact_sheet = os.path.join(preview_dir, image_filename(CONTACT_SHEET, manifest["image_format"]))
+            save_image(combine_images_grid(sorted(preview_files), 5), contact_sheet, manifest["image_format"])
+            print(f"Saved {contact_sheet}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply several mapping presets to schematic packs in one pass.")
+    parser.add_argument("manifest", help="job manifest (.json or .toml)")
+    args = parser.parse_args()
+    run_manifest(args.manifest)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import re
+
+import numpy as np
+
+REGION_SEPARATOR = "@"
+TARGET_SEPARATOR = "|"
+WEIGHT_SEPARATOR = "*"
+_BOUNDS_PATTERN = re.compile(r"^([xyz])=(-?\d+)?(?:(\.\.)(-?\d+)?)?$")
+
+
+class Region:
+    """
+    Axis-aligned box in schematic coordinates. Bounds are inclusive, None leaves that side open.
+    Written as "y=..4", "y=5", "x=0..10,z=3.." (axes separated by comma or space).
+    """
+
+    def __init__(self, x: tuple[int | None, int | None] = (None, None), y: tuple[int | None, int | None] = (None, None),
+                 z: tuple[int | None, int | None] = (None, None)):
+        self.bounds = {"x": x, "y": y, "z": z}
+
+    @classmethod
+    def parse(cls, text: str) -> "Region":
+        bounds = {}
+        for part in re.split(r"[,\s]+", text.strip()):
+            if not part:
+                continue
+            match = _BOUNDS_PATTERN.match(part)
+            if not match or (match.group(2) is None and match.group(4) is None):
+                raise ValueError(f"Invalid region '{part}', expected something like y=..4 or x=0..10")
+            axis, low, dots, high = match.groups()
+            low = int(low) if low is not None else None
+            high = int(high) if high is not None else (None if dots else low)
+            bounds[axis] = (low, high)
+        if not bounds:
+            raise ValueError("Empty region")
+        return cls(**bounds)
+
+    def slices(self) -> tuple[slice, slice, slice]:
+        """Slices into a Schematic.blocks array, which is indexed [y, z, x]."""
+
+        def axis_slice(axis: str) -> slice:
+            low, high = self.bounds[axis]
+            start = max(0, low) if low is not None else None
+            stop = max(0, high + 1) if high is not None else None
+            return slice(start, stop)
+
+        return axis_slice("y"), axis_slice("z"), axis_slice("x")
+
+    def __str__(self):
+        parts = []
+        for axis, (low, high) in self.bounds.items():
+            if low is None and high is None:
+                continue
+            if low is not None and low == high:
+                parts.append(f"{axis}={low}")
+            else:
+                parts.append(f"{axis}={'' if low is None else low}..{'' if high is None else high}")
+        return ",".join(parts)
+
+
+class WeightedTargets:
+    """
+    Weighted random replacement, written as "minecraft:stone*70 | minecraft:andesite*20 | minecraft:cobblestone*10".
+    A weight written as "70..10" is a height gradient: 70 at the bottom of the replaced area, 10 at its top.
+    Targets without a weight count as 1.
+    """
+
+    def __init__(self, blocks: list[str], bottom_weights: list[float], top_weights: list[float]):
+        self.blocks = blocks
+        self.bottom_weights = np.array(bottom_weights, dtype=np.float64)
+        self.top_weights = np.array(top_weights, dtype=np.float64)
+
+    @classmethod
+    def parse(cls, text: str) -> "WeightedTargets":
+        blocks, bottom_weights, top_weights = [], [], []
+        for part in text.split(TARGET_SEPARATOR):
+            block, _, weight = part.partition(WEIGHT_SEPARATOR)
+            block = block.strip()
+            if not block:
+                raise ValueError(f"Missing block in '{text}'")
+            bottom, _, top = (weight.strip() or "1").partition("..")
+            try:
+                bottom = float(bottom)
+                top = float(top) if top else bottom
+            except ValueError:
+                raise ValueError(f"Invalid weight '{weight.strip()}' for {block}")
+            if bottom < 0 or top < 0:
+                raise ValueError(f"Negative weight for {block}")
+            blocks.append(block)
+            bottom_weights.append(bottom)
+            top_weights.append(top)
+        if not (sum(bottom_weights) > 0 and sum(top_weights) > 0):
+            raise ValueError(f"Weights in '{text}' add up to 0")
+        return cls(blocks, bottom_weights, top_weights)
+
+    def has_gradient(self) -> bool:
+        return not np.array_equal(self.bottom_weights, self.top_weights)
+
+    def cumulative_weights(self, num_heights: int) -> np.ndarray:
+        """(num_heights, num_targets) cumulative probabilities, interpolated from bottom to top weights."""
+        t = np.linspace(0.0, 1.0, num_heights)[:, None] if num_heights > 1 else np.zeros((1, 1))
+        weights = self.bottom_weights + (self.top_weights - self.bottom_weights) * t
+        cumulative = np.cumsum(weights, axis=1)
+        return cumulative / cumulative[:, -1:]
+
+    def __str__(self):
+        parts = []
+        for block, bottom, top in zip(self.blocks, self.bottom_weights, self.top_weights):
+            weight = f"{bottom:g}" if bottom == top else f"{bottom:g}..{top:g}"
+            parts.append(f"{block}{WEIGHT_SEPARATOR}{weight}")
+        return f" {TARGET_SEPARATOR} ".join(parts)
+
+
+def split_replacement(value: str) -> tuple[str | WeightedTargets, Region | None]:
+    """
+    Split a mapping value like "minecraft:podzol @ y=..4" into the replacement and its optional region.
+    Replacements with several targets or weights are returned as WeightedTargets.
+    """
+    replacement, _, region = value.partition(REGION_SEPARATOR)
+    replacement = replacement.strip()
+    if TARGET_SEPARATOR in replacement or WEIGHT_SEPARATOR in replacement:
+        replacement = WeightedTargets.parse(replacement)
+    return replacement, Region.parse(region) if region.strip() else None
+
+
+def compile_mappings(mappings: dict[str, str]) -> dict[str, tuple[str | WeightedTargets, Region | None]]:
+    """Parse every set mapping once. Empty and identical mappings are skipped, errors name the block."""
+    compiled = {}
+    for block, replacement in mappings.items():
+        if replacement == "" or replacement == block:
+            continue
+        try:
+            compiled[block] = split_replacement(replacement)
+        except ValueError as e:
+            raise ValueError(f"{block}: {e}")
+    return compiled
+
+
+def load_mapping_file(file_path: str) -> dict[str, str]:
+    mappings = {}
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or "\t" not in line:
+                continue  # skip empty or malformed lines
+            key, value = line.split("\t", 1)
+            mappings[key] = value
+    return mappings
+
+
+def save_mapping_file(file_path: str, mappings: dict[str, str]) -> None:
+    with open(file_path, "w", encoding="utf-8") as f:
+        for key, value in mappings.items():
+            if value == "":
+                continue
+            f.write(f"{key}\t{value}\n")
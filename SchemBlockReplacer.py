@@ -1,13 +1,20 @@
 import os
 import re
 import tkinter as tk
+from collections import deque
 from tkinter import filedialog, messagebox
 
-import nbtlib
+import numpy as np
 
 from BlockMappingTable import block_mapping_table
+from MappingRules import Region, WeightedTargets, compile_mappings, load_mapping_file, save_mapping_file
+from Schematic import Schematic
+from SchematicCache import WorkingCache
+from SchematicDedup import DuplicateGroups
 
 BLOCK_LIST_FILE = "./minecraft_blocks.txt"
+UNDO_DEPTH = 50
+RANDOM_SEED = 0
 
 
 class ToolTip:
@@ -34,87 +41,265 @@ class ToolTip:
             self.tooltip = None
 
 
-def load_schem_files(schem_files):
+def load_schem_files(schem_files, cache: WorkingCache | None = None, duplicates: DuplicateGroups | None = None):
+    """
+    Load .schem files by path. If duplicates is given, identical schematics share one Schematic object,
+    so a replace is done once per group and saving writes the result to every path of the group.
+    """
     schem_data_dict = {}
 
     for schem_file in schem_files:
-        schem_data = nbtlib.File.load(schem_file, gzipped=True)
+        if cache is not None:
+            schem_data = Schematic.from_nbt(cache.load(schem_file))
+        else:
+            schem_data = Schematic.from_file(schem_file)
+        if duplicates is not None:
+            original = duplicates.add(schem_file, schem_data)
+            if original is not None:
+                schem_data = schem_data_dict[original]
         schem_data_dict[schem_file] = schem_data
 
     return schem_data_dict
 
 
-def replace_blocks(schem_data, block_to_replace, replace_with):
+def replace_blocks(schem_data: Schematic, block_to_replace, replace_with: str | WeightedTargets,
+                   journal_step: list | None = None, region: Region | None = None, seed: int = RANDOM_SEED):
     replaced_blocks = 0
-    if not schem_data:
+    if schem_data is None:
         return "Invalid schematic data"
 
-    if 'Palette' in schem_data:
-        palette = schem_data['Palette']
+    palette = schem_data.palette
+    block_names = schem_data.block_names()
+    weighted = isinstance(replace_with, WeightedTargets)
+    targets = replace_with.blocks if weighted else [replace_with]
 
-        if "[" not in block_to_replace and "[" in replace_with and any(
-                replace_with.split("[")[0] + "[" in item for item in palette):
+    for target in targets:
+        if "[" not in block_to_replace and "[" in target and any(
+                target.split("[")[0] + "[" in item for item in block_names):
             return "Please remove the properties of the replacement block (everything in brackets) to prevent conflicts."
 
-        if block_to_replace == replace_with:
-            return "The 'block_to_replace' and 'replace_with' are identical. No need to replace blocks."
-
-        found = False
-
-        for block in palette:
-            if "[" not in block_to_replace:
-                if block_to_replace == block.split("[")[0]:
-                    found = True
-                    break
-            else:
-                if block_to_replace in block:
-                    found = True
-                    break
+    if not weighted and block_to_replace == replace_with:
+        return "The 'block_to_replace' and 'replace_with' are identical. No need to replace blocks."
 
-        if found == False:
-            return f"No matching blocks found for: {block_to_replace}"
+    found = False
 
+    for block in block_names:
         if "[" not in block_to_replace:
-            changes = []
-
-            for block in palette:
-                if block_to_replace == block.split("[")[0]:
-                    new_key = block.replace(block_to_replace, replace_with)
-                    changes.append((block, new_key))
-
-            for old_key, new_key in changes:
-                palette[new_key] = palette.pop(old_key)
+            if block_to_replace == block.split("[")[0]:
+                found = True
+                break
         else:
-            if replace_with in palette:
-                to_replace_index = palette[block_to_replace]
-                replace_with_index = palette[replace_with]
-                block_data = schem_data['BlockData']
-
-                block_data_bytes = bytearray(block_data)
-
-                modified = False
-                for i, block in enumerate(block_data_bytes):
-                    if block == to_replace_index:
-                        block_data_bytes[i] = replace_with_index
-                        modified = True
-
-                if modified:
-                    schem_data['BlockData'] = nbtlib.ByteArray(block_data_bytes)
-
-                del palette[block_to_replace]
-            else:
-                palette[replace_with] = palette.pop(block_to_replace)
-
-        replaced_blocks += 1
-
-        schem_data['PaletteMax'] = nbtlib.Int(len(palette))
-
-        return f"Replaced {replaced_blocks} blocks"
-
-
-def save_schem_file(schem_data, filepath):
+            if block_to_replace == block:
+                found = True
+                break
+
+    if found == False:
+        return f"No matching blocks found for: {block_to_replace}"
+
+    # (palette id, block state, new block state for every target)
+    changes = []
+    for block_id, block in enumerate(palette):
+        if block is None:
+            continue
+        if "[" not in block_to_replace:
+            if block_to_replace != block.split("[")[0]:
+                continue
+            new_keys = [block.replace(block_to_replace, target) for target in targets]
+        else:
+            if block_to_replace != block:
+                continue
+            new_keys = targets
+        changes.append((block_id, block, new_keys))
+
+    if weighted:
+        remap_weighted(schem_data, changes, replace_with, region, seed, journal_step)
+    elif region is None:
+        # Renaming palette entries is enough: ids that end up with the same block state are merged on save
+        for block_id, block, (new_key,) in changes:
+            palette[block_id] = new_key
+            if journal_step is not None:
+                journal_step.append(("rename", schem_data, block_id, block, new_key))
+    else:
+        remap_region(schem_data, changes, region, journal_step)
+
+    replaced_blocks += 1
+
+    return f"Replaced {replaced_blocks} blocks"
+
+
+def apply_mappings(schem_data: Schematic, mappings: dict, journal_step: list | None = None,
+                   seed: int = RANDOM_SEED) -> list[str]:
+    """Run replace_blocks for every compiled mapping (see MappingRules.compile_mappings), returns their messages."""
+    messages = []
+    for block, (replacement, region) in mappings.items():
+        messages.append(replace_blocks(schem_data, block, replacement, journal_step, region, seed))
+    return messages
+
+
+def add_target_blocks(schem_data: Schematic, changes: list, journal_step: list | None) -> np.ndarray:
+    """(number of changes, number of targets) palette ids of the new block states, added to the palette if missing."""
+    num_ids = len(schem_data.palette)
+    target_ids = np.array([[schem_data.add_block(new_key) for new_key in new_keys] for _, _, new_keys in changes])
+    if journal_step is not None:
+        for block_id in range(num_ids, len(schem_data.palette)):
+            journal_step.append(("add", schem_data, block_id, schem_data.palette[block_id]))
+    if target_ids.size:
+        schem_data.widen_to(int(target_ids.max()))
+    return target_ids.astype(schem_data.blocks.dtype)
+
+
+def region_view(schem_data: Schematic, region: Region | None) -> tuple[np.ndarray, tuple[slice, slice, slice], range]:
+    """
+    View of the voxels inside region, the slices that select it and the region's Y range (in whole schematic
+    coordinates). For a slab of a streamed schematic the region is clipped to the slab's layers.
+    """
+    y_slice, z_slice, x_slice = region.slices() if region is not None else (slice(None), slice(None), slice(None))
+    region_rows = range(*y_slice.indices(schem_data.full_height))
+    slab_start = min(max(region_rows.start - schem_data.y_offset, 0), schem_data.height)
+    slab_stop = max(min(region_rows.stop - schem_data.y_offset, schem_data.height), slab_start)
+    region_slices = (slice(slab_start, slab_stop), z_slice, x_slice)
+    return schem_data.blocks[region_slices], region_slices, region_rows
+
+
+def record_voxels(schem_data: Schematic, journal_step: list, changed: np.ndarray, region_slices, old_ids, new_ids):
+    """Journal the voxels where the region-shaped mask changed is set, by their flat position in the whole volume."""
+    shape = schem_data.blocks.shape
+    offsets = [region_slice.indices(size)[0] for region_slice, size in zip(region_slices, shape)]
+    coords = tuple(axis_coords + offset for axis_coords, offset in zip(np.nonzero(changed), offsets))
+    positions = np.ravel_multi_index(coords, shape).astype(np.min_scalar_type(schem_data.blocks.size))
+    journal_step.append(("voxels", schem_data, positions, old_ids, new_ids))
+
+
+def remap_region(schem_data: Schematic, changes: list, region: Region, journal_step: list | None = None) -> None:
+    """Point the voxels inside region from the old palette ids in changes to (possibly new) ids of the new block states."""
+    target_ids = add_target_blocks(schem_data, changes, journal_step)
+    lut = np.arange(len(schem_data.palette), dtype=schem_data.blocks.dtype)
+    for (block_id, _, _), (new_id,) in zip(changes, target_ids):
+        lut[block_id] = new_id
+
+    view, region_slices, _ = region_view(schem_data, region)
+    remapped = lut[view]
+    changed = remapped != view
+    if journal_step is not None:
+        record_voxels(schem_data, journal_step, changed, region_slices, view[changed], remapped[changed])
+    np.copyto(view, remapped, where=changed)
+
+
+def remap_weighted(schem_data: Schematic, changes: list, weighted: WeightedTargets, region: Region | None, seed: int,
+                   journal_step: list | None = None) -> None:
+    """
+    Replace every matching voxel (inside region) by one of the weighted targets, drawn in one vectorized pass
+    from a generator seeded with seed, so the same seed always gives the same result. Slabs of a streamed
+    schematic draw from their own generator, seeded with seed and their height.
+    """
+    target_ids = add_target_blocks(schem_data, changes, journal_step)
+    source_index = np.full(len(schem_data.palette), -1, dtype=np.int16)
+    for index, (block_id, _, _) in enumerate(changes):
+        source_index[block_id] = index
+
+    view, region_slices, region_rows = region_view(schem_data, region)
+    if view.size == 0:
+        return
+    sources = source_index[view]
+    matching = sources >= 0
+    sources = sources[matching]
+    # the gradient spans the whole region, a slab only uses its own layers of it
+    first_row = schem_data.y_offset + region_slices[0].start - region_rows.start
+    cumulative = weighted.cumulative_weights(len(region_rows))[first_row:first_row + view.shape[0]].astype(np.float32)
+    # matching voxels come in y-major order, so per-layer thresholds are repeated by the layer's match count
+    matches_per_layer = matching.reshape(view.shape[0], -1).sum(axis=1) if weighted.has_gradient() else None
+    rng = np.random.default_rng(seed if schem_data.y_offset == 0 else [seed, schem_data.y_offset])
+    draws = rng.random(len(sources), dtype=np.float32)
+    choices = np.zeros(len(sources), dtype=np.uint8)
+    for target in range(cumulative.shape[1] - 1):
+        if matches_per_layer is None:
+            choices += draws >= cumulative[0, target]
+        else:
+            choices += draws >= np.repeat(cumulative[:, target], matches_per_layer)
+
+    new_ids = target_ids[sources, choices]
+    if journal_step is not None:
+        record_voxels(schem_data, journal_step, matching, region_slices, view[matching], new_ids)
+    view[matching] = new_ids
+
+
+class EditJournal:
+    """
+    Bounded undo/redo history for replace_blocks. A step holds the palette edits it made and, for region-scoped
+    rules, the positions and ids of the voxels it changed, so undo and redo replay them in reverse instead of
+    restoring copies of the schematics.
+    """
+
+    def __init__(self, max_depth: int = UNDO_DEPTH):
+        self.undo_steps = deque(maxlen=max_depth)
+        self.redo_steps = []
+
+    def record(self, step: list) -> None:
+        if step:
+            self.undo_steps.append(step)
+            self.redo_steps.clear()
+
+    def can_undo(self) -> bool:
+        return len(self.undo_steps) > 0
+
+    def can_redo(self) -> bool:
+        return len(self.redo_steps) > 0
+
+    def undo(self) -> bool:
+        if not self.undo_steps:
+            return False
+        step = self.undo_steps.pop()
+        for operation in reversed(step):
+            self._undo_operation(operation)
+        self.redo_steps.append(step)
+        return True
+
+    def redo(self) -> bool:
+        if not self.redo_steps:
+            return False
+        step = self.redo_steps.pop()
+        for operation in step:
+            self._redo_operation(operation)
+        self.undo_steps.append(step)
+        return True
+
+    def clear(self) -> None:
+        self.undo_steps.clear()
+        self.redo_steps.clear()
+
+    @staticmethod
+    def _undo_operation(operation) -> None:
+        kind, schem_data = operation[0], operation[1]
+        if kind == "rename":
+            _, _, block_id, old_key, new_key = operation
+            schem_data.palette[block_id] = old_key
+        elif kind == "add":
+            _, _, block_id, block = operation
+            schem_data.palette[block_id] = None
+        elif kind == "voxels":
+            _, _, positions, old_ids, new_ids = operation
+            schem_data.blocks.reshape(-1)[positions] = old_ids
+
+    @staticmethod
+    def _redo_operation(operation) -> None:
+        kind, schem_data = operation[0], operation[1]
+        if kind == "rename":
+            _, _, block_id, old_key, new_key = operation
+            schem_data.palette[block_id] = new_key
+        elif kind == "add":
+            _, _, block_id, block = operation
+            schem_data.palette[block_id] = block
+        elif kind == "voxels":
+            _, _, positions, old_ids, new_ids = operation
+            schem_data.blocks.reshape(-1)[positions] = new_ids
+
+
+def save_schem_file(schem_data: Schematic, filepath, cache: WorkingCache | None = None):
     try:
-        schem_data.save(filepath)
+        if cache is not None:
+            cache.export(schem_data.to_nbt(), filepath)
+        else:
+            schem_data.to_file(filepath)
     except Exception as e:
         return f"Error saving file: {e}"
 
@@ -123,9 +308,7 @@ def get_unique_blocks_from_modified_data(modified_schem_data):
     unique_blocks: set[str] = set()
 
     for schem_data in modified_schem_data.values():
-        palette = schem_data.get('Palette', {})
-
-        for block in palette:
+        for block in schem_data.block_names():
             unique_blocks.add(block)
     blocks_no_params = []
     for block in unique_blocks:
@@ -207,14 +390,26 @@ def main():
         top.wait_window()
         return top.result
 
+    def get_working_cache() -> WorkingCache | None:
+        nonlocal working_cache
+        if not use_working_cache.get():
+            return None
+        if working_cache is None:
+            working_cache = WorkingCache()
+        return working_cache
+
     def set_input_widgets_state(state):
         button_save_changes.config(state=state)
         button_save_copy.config(state=state)
+        update_undo_buttons()
+
+    def update_undo_buttons():
+        button_undo.config(state=tk.NORMAL if journal.can_undo() else tk.DISABLED)
+        button_redo.config(state=tk.NORMAL if journal.can_redo() else tk.DISABLED)
 
     def on_replace_blocks(mappings: dict[str, str]):
         global unsaved_changes
         nonlocal modified_schem_data
-        valid_mappings = {}
         for block, replacement in mappings.items():
             if replacement == "":  # ignore mappings that are not set
                 continue
@@ -226,15 +421,31 @@ def main():
             elif block == "" or replacement == "":
                 messagebox.showerror("Replace Blocks", "Please fill out all fields.")
                 return
-            valid_mappings[block] = replacement
+        try:
+            valid_mappings = compile_mappings(mappings)
+        except ValueError as e:
+            messagebox.showerror("Replace Blocks", str(e))
+            return
+        try:
+            seed = int(random_seed.get())
+        except ValueError:
+            messagebox.showerror("Replace Blocks", "The random seed has to be a whole number.")
+            return
 
         messages = []
+        journal_step = []
+        replaced_files = {}
         for filepath in new_schem_files:
             schem_data = modified_schem_data.get(filepath)
-            for block, replacement in valid_mappings.items():
-                message = replace_blocks(schem_data, block, replacement)
+            if id(schem_data) in replaced_files:
+                messages.append(f"{os.path.basename(filepath)}: identical to {replaced_files[id(schem_data)]}")
+                continue
+            replaced_files[id(schem_data)] = os.path.basename(filepath)
+            for message in apply_mappings(schem_data, valid_mappings, journal_step, seed):
                 messages.append(f"{os.path.basename(filepath)}: {message}")
             modified_schem_data[filepath] = schem_data
+        journal.record(journal_step)
+        update_undo_buttons()
 
         unsaved_changes = True
         root.title(".Schem Block Replacer (Unsaved Changes)")
@@ -243,6 +454,21 @@ def main():
 
         update_known_block_list(list(get_current_mappings().keys()))
 
+    def on_undo(event=None):
+        on_journal_change(journal.undo())
+
+    def on_redo(event=None):
+        on_journal_change(journal.redo())
+
+    def on_journal_change(changed: bool):
+        global unsaved_changes
+        update_undo_buttons()
+        if not changed:
+            return
+        unsaved_changes = True
+        root.title(".Schem Block Replacer (Unsaved Changes)")
+        update_master_list(modified_schem_data)
+
     def update_known_block_list(blocks: list[str]):
         print(f"adding blocks: {blocks}")
         block_suggestions = set(load_block_list(BLOCK_LIST_FILE))
@@ -261,11 +487,14 @@ def main():
         new_schem_files = filedialog.askopenfilenames(title="Select .schem file(s)",
                                                       filetypes=[("Schem Files", "*.schem")])
         if new_schem_files:
-            modified_schem_data = load_schem_files(new_schem_files)
+            duplicates = DuplicateGroups()
+            modified_schem_data = load_schem_files(new_schem_files, get_working_cache(), duplicates)
+            journal.clear()
             update_master_list(modified_schem_data)
             set_input_widgets_state(tk.NORMAL)
             unsaved_changes = False
             root.title(".Schem Block Replacer")
+            show_message("Duplicate Schematics", duplicates.report(), False)
 
     def update_master_list(modified_schem_data):
         unique_blocks = list(get_unique_blocks_from_modified_data(modified_schem_data))
@@ -296,7 +525,7 @@ def main():
             return
 
         for filepath, schem_data in modified_schem_data.items():
-            save_schem_file(schem_data, filepath)
+            save_schem_file(schem_data, filepath, get_working_cache())
             saved_filepaths.append(filepath)
 
         unsaved_changes = False
@@ -319,7 +548,7 @@ def main():
 
         for filepath, schem_data in modified_schem_data.items():
             new_filepath = filepath.split(".")[0] + "_copy.schem"
-            save_schem_file(schem_data, new_filepath)
+            save_schem_file(schem_data, new_filepath, get_working_cache())
             saved_filepaths.append(new_filepath)
 
         unsaved_changes = False
@@ -343,11 +572,7 @@ def main():
         if not file_path:
             return  # User canceled
 
-        with open(file_path, "w", encoding="utf-8") as f:
-            for key, value in mappings.items():
-                if value == "":
-                    continue
-                f.write(f"{key}\t{value}\n")
+        save_mapping_file(file_path, mappings)
 
     def on_load_settings():
         print("load settings")
@@ -362,14 +587,7 @@ def main():
         if not file_path:
             return {}
 
-        mappings_from_file = {}
-        with open(file_path, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line or "\t" not in line:
-                    continue  # skip empty or malformed lines
-                key, value = line.split("\t", 1)
-                mappings_from_file[key] = value
+        mappings_from_file = load_mapping_file(file_path)
         old_mappings = get_current_mappings()
         for block, replacement in mappings_from_file.items():
             old_mappings[block] = mappings_from_file[block]
@@ -397,6 +615,7 @@ def main():
         nonlocal new_schem_files, modified_schem_data
         new_schem_files = []
         modified_schem_data = {}
+        journal.clear()
         master_list_label_text.set("No schem files loaded.")
         set_input_widgets_state(tk.DISABLED)
         unsaved_changes = False
@@ -425,6 +644,10 @@ def main():
 
     new_schem_files = []
     modified_schem_data = {}
+    working_cache = None
+    journal = EditJournal(UNDO_DEPTH)
+    use_working_cache = tk.BooleanVar(value=False)
+    random_seed = tk.StringVar(value=str(RANDOM_SEED))
 
     master_list_label_text = tk.StringVar()
     master_list_label = tk.Label(root, textvariable=master_list_label_text, anchor=tk.W)
@@ -456,6 +679,28 @@ def main():
     button_reset_all.pack(pady=5)
     ToolTip(button_reset_all, "Unload .schem(s) and reset the table to a clean state")
 
+    button_undo = tk.Button(frame_input, text="Undo replace", command=on_undo)
+    button_undo.pack(pady=5)
+    ToolTip(button_undo, f"Undo the last replace on all loaded .schem(s) (Ctrl+Z), up to {UNDO_DEPTH} steps")
+
+    button_redo = tk.Button(frame_input, text="Redo replace", command=on_redo)
+    button_redo.pack(pady=5)
+    ToolTip(button_redo, "Redo the last undone replace (Ctrl+Y)")
+
+    root.bind("<Control-z>", on_undo)
+    root.bind("<Control-y>", on_redo)
+
+    frame_seed = tk.Frame(frame_input)
+    frame_seed.pack(pady=5)
+    tk.Label(frame_seed, text="Random seed").pack(side=tk.LEFT)
+    entry_seed = tk.Entry(frame_seed, textvariable=random_seed, width=8)
+    entry_seed.pack(side=tk.LEFT, padx=(5, 0))
+    ToolTip(entry_seed, "Seed for weighted replacements like 'minecraft:stone*70 | minecraft:andesite*30', the same seed gives the same result")
+
+    check_working_cache = tk.Checkbutton(frame_input, text="Use working cache", variable=use_working_cache)
+    check_working_cache.pack(pady=5)
+    ToolTip(check_working_cache, "Keep uncompressed copies of opened .schem(s) in a cache folder so reopening them is instant")
+
     divider = tk.Frame(frame_input, height=2, bd=1, relief=tk.SUNKEN)
     divider.pack(fill=tk.X, padx=5, pady=10)
 
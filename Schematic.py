@@ -0,0 +1,189 @@
+import nbtlib
+import numpy as np
+
+# Tags that Schematic keeps as columns; everything else is carried over untouched in metadata.
+COLUMN_TAGS = ("Width", "Height", "Length", "Palette", "PaletteMax", "BlockData", "BlockEntities")
+
+
+def decode_varints(data: np.ndarray) -> np.ndarray:
+    """Decode Sponge BlockData (unsigned LEB128 varints). Palettes below 128 entries decode to the input array itself."""
+    continuation = data >= 0x80
+    if not continuation.any():
+        return data
+
+    ends = np.flatnonzero(~continuation)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    lengths = ends - starts + 1
+
+    values = np.zeros(len(ends), dtype=np.uint32)
+    for k in range(int(lengths.max())):
+        selected = lengths > k
+        values[selected] |= (data[starts[selected] + k] & 0x7F).astype(np.uint32) << (7 * k)
+    return values
+
+
+def encode_varints(values: np.ndarray) -> np.ndarray:
+    """Inverse of decode_varints. Returns values as-is (viewed as bytes) when every id fits in one byte."""
+    if values.size == 0 or int(values.max()) < 0x80:
+        return values if values.dtype == np.uint8 else values.astype(np.uint8)
+
+    values = values.astype(np.uint32)
+    num_bytes = np.ones(values.size, dtype=np.int64)
+    for shift in (7, 14, 21, 28):
+        num_bytes += values >= (1 << shift)
+    offsets = np.cumsum(num_bytes) - num_bytes
+
+    encoded = np.empty(int(num_bytes.sum()), dtype=np.uint8)
+    for k in range(int(num_bytes.max())):
+        selected = num_bytes > k
+        byte = (values[selected] >> (7 * k)) & 0x7F
+        more = num_bytes[selected] > k + 1
+        encoded[offsets[selected] + k] = byte | (more.astype(np.uint32) << 7)
+    return encoded
+
+
+def index_dtype(max_id: int) -> np.dtype:
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_id <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    raise ValueError(f"Palette id {max_id} does not fit into 32 bit")
+
+
+class Schematic:
+    """
+    Sponge .schem file in columnar form: dimensions, an id-ordered palette, a typed (height, length, width) index
+    array over the voxels and the block entities as a side table.
+
+    palette[i] is the block state for index i. Unused ids are None and several ids may share one block state;
+    both are resolved when writing, so renames and merges are plain palette edits that never touch the voxels.
+
+    A Schematic can also be one Y-slab of a taller one that is streamed (see SchematicStream): y_offset is the
+    height of its lowest layer and full_height the height of the whole schematic.
+    """
+
+    def __init__(self, width: int, height: int, length: int, palette: list[str | None], blocks: np.ndarray,
+                 block_entities=None, metadata: nbtlib.Compound | None = None, root_name: str = "Schematic",
+                 y_offset: int = 0, full_height: int | None = None):
+        self.width = width
+        self.height = height
+        self.length = length
+        self.palette = palette
+        self.blocks = blocks.reshape(height, length, width)
+        # every palette id has to fit, also unused ones: edits may point voxels at any of them
+        self.widen_to(len(palette) - 1)
+        self.block_entities = block_entities if block_entities is not None else nbtlib.List[nbtlib.Compound]()
+        self.metadata = metadata if metadata is not None else nbtlib.Compound({"Version": nbtlib.Int(2)})
+        self.root_name = root_name
+        self.y_offset = y_offset
+        self.full_height = full_height if full_height is not None else height
+
+    @classmethod
+    def from_nbt(cls, schem_data: nbtlib.Compound) -> "Schematic":
+        width = int(schem_data["Width"])
+        height = int(schem_data["Height"])
+        length = int(schem_data["Length"])
+
+        palette_tag = schem_data["Palette"]
+        palette: list[str | None] = [None] * (max(palette_tag.values(), default=-1) + 1)
+        for block_name, block_id in palette_tag.items():
+            palette[block_id] = block_name
+
+        # nbtlib parses arrays into read-only buffers: one owned copy, after that all edits are in place.
+        # The copy is wide enough for every palette id, even when only ids below 128 are used.
+        block_data = np.asarray(schem_data["BlockData"]).view(np.uint8)
+        blocks = decode_varints(block_data)
+        dtype = index_dtype(max(len(palette) - 1, 0))
+        if blocks is block_data and dtype == blocks.dtype and not blocks.flags.writeable:
+            blocks = blocks.copy()
+        elif blocks is not block_data or dtype != blocks.dtype:
+            blocks = blocks.astype(dtype)
+
+        metadata = nbtlib.Compound({key: value for key, value in schem_data.items() if key not in COLUMN_TAGS})
+        return cls(width, height, length, palette, blocks, schem_data.get("BlockEntities"), metadata,
+                   getattr(schem_data, "root_name", "Schematic"))
+
+    @classmethod
+    def from_file(cls, filepath: str) -> "Schematic":
+        return cls.from_nbt(nbtlib.File.load(filepath, gzipped=True))
+
+    def resolve_palette(self) -> tuple[dict[str, int], np.ndarray | None]:
+        """
+        Palette as written to file: duplicate block states merged onto their first id, unused ids left out.
+        Also returns the id lookup table the voxels have to go through, or None if they can be written as they are.
+        """
+        palette_tag = {}
+        remap = np.arange(len(self.palette), dtype=index_dtype(len(self.palette)))
+        for block_id, block_name in enumerate(self.palette):
+            if block_name is None:
+                continue
+            if block_name in palette_tag:
+                remap[block_id] = palette_tag[block_name]
+            else:
+                palette_tag[block_name] = block_id
+
+        if len(palette_tag) < sum(name is not None for name in self.palette):
+            return palette_tag, remap
+        return palette_tag, None
+
+    def to_nbt(self) -> nbtlib.File:
+        palette_tag, remap = self.resolve_palette()
+        blocks = self.blocks.ravel()
+        if remap is not None:
+            blocks = remap[blocks]
+
+        schem_data = nbtlib.File(self.metadata, root_name=self.root_name, gzipped=True)
+        schem_data["Width"] = nbtlib.Short(self.width)
+        schem_data["Height"] = nbtlib.Short(self.height)
+        schem_data["Length"] = nbtlib.Short(self.length)
+        schem_data["PaletteMax"] = nbtlib.Int(len(palette_tag))
+        schem_data["Palette"] = nbtlib.Compound({name: nbtlib.Int(block_id) for name, block_id in palette_tag.items()})
+        schem_data["BlockData"] = nbtlib.ByteArray(encode_varints(blocks).view(np.int8))
+        if self.block_entities:
+            schem_data["BlockEntities"] = self.block_entities
+        return schem_data
+
+    def to_file(self, filepath: str) -> None:
+        self.to_nbt().save(filepath, gzipped=True)
+
+    def copy(self, share_blocks: bool = False) -> "Schematic":
+        """
+        Copy of palette and voxels; block entities and metadata are shared. With share_blocks the voxels are shared
+        too, which is safe as long as only the palette of the copy is edited (e.g. renames by replace_blocks).
+        """
+        blocks = self.blocks if share_blocks else self.blocks.copy()
+        return Schematic(self.width, self.height, self.length, list(self.palette), blocks,
+                         self.block_entities, self.metadata, self.root_name, self.y_offset, self.full_height)
+
+    def block_names(self) -> set[str]:
+        return {block_name for block_name in self.palette if block_name is not None}
+
+    def block_counts(self) -> dict[str, int]:
+        """Number of voxels per block state."""
+        counts = np.bincount(self.blocks.ravel(), minlength=len(self.palette))
+        block_counts: dict[str, int] = {}
+        for block_id, count in enumerate(counts.tolist()):
+            block_name = self.palette[block_id] if block_id < len(self.palette) else None
+            if block_name is not None and count:
+                block_counts[block_name] = block_counts.get(block_name, 0) + count
+        return block_counts
+
+    def ids_of(self, block_name: str) -> list[int]:
+        return [block_id for block_id, name in enumerate(self.palette) if name == block_name]
+
+    def widen_to(self, max_id: int) -> None:
+        """Widen the index array in place (a new array) if it cannot hold palette id max_id."""
+        if max_id > np.iinfo(self.blocks.dtype).max:
+            self.blocks = self.blocks.astype(index_dtype(max_id))
+
+    def add_block(self, block_name: str) -> int:
+        """Palette id for block_name, appending a new entry if needed; the index array can always hold the id."""
+        ids = self.ids_of(block_name)
+        if ids:
+            block_id = ids[0]
+        else:
+            self.palette.append(block_name)
+            block_id = len(self.palette) - 1
+        self.widen_to(block_id)
+        return block_id
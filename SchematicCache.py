@@ -0,0 +1,77 @@
+import hashlib
+import os
+
+import nbtlib
+
+CACHE_DIR = "./.schem_cache"
+CACHE_MAX_BYTES = 2 * 1024 ** 3  # 2 GiB of uncompressed schematics
+
+
+def hash_file(filepath: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class WorkingCache:
+    """
+    Session cache of decoded schematics, stored as uncompressed NBT files named after the hash of the
+    source .schem content. Opening a cached file skips the gunzip entirely, edited sources hash to a new
+    key so stale entries are never read, and the least recently used entries are evicted above max_bytes.
+    """
+
+    def __init__(self, cache_dir: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".nbt")
+
+    def load(self, filepath: str) -> nbtlib.File:
+        """Load a .schem file, from its uncompressed cache entry if one exists."""
+        key = hash_file(filepath)
+        entry = self.entry_path(key)
+        if os.path.exists(entry):
+            os.utime(entry)  # mark as recently used
+            schem_data = nbtlib.File.load(entry, gzipped=False)
+        else:
+            schem_data = nbtlib.File.load(filepath, gzipped=True)
+            self.store(key, schem_data)
+        # saving without arguments writes a normal .schem back to the source
+        schem_data.filename = filepath
+        schem_data.gzipped = True
+        return schem_data
+
+    def store(self, key: str, schem_data: nbtlib.File) -> None:
+        entry = self.entry_path(key)
+        tmp_entry = entry + ".tmp"
+        schem_data.save(tmp_entry, gzipped=False)
+        os.replace(tmp_entry, entry)
+        self.evict()
+
+    def export(self, schem_data: nbtlib.File, filepath: str) -> None:
+        """Compress the schematic to a .schem file and cache it, so reopening the export is instant too."""
+        schem_data.save(filepath, gzipped=True)
+        self.store(hash_file(filepath), schem_data)
+
+    def evict(self) -> None:
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith(".nbt"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def clear(self) -> None:
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith((".nbt", ".tmp")):
+                os.remove(entry.path)
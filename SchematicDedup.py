@@ -0,0 +1,49 @@
+import hashlib
+
+import numpy as np
+
+from Schematic import Schematic
+
+
+def fingerprint(schem: Schematic) -> str:
+    """
+    Content hash over dimensions, palette, voxel indices, block entities and metadata, fed to the hash piece by
+    piece. Files in a group share one Schematic when saved, so everything that is written has to be covered.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{schem.root_name}\n{schem.width}x{schem.height}x{schem.length}\n".encode())
+    digest.update(str(schem.metadata).encode() + b"\n")
+    digest.update(str(schem.block_entities).encode() + b"\n")
+    for block_name in schem.palette:
+        digest.update((block_name or "").encode() + b"\n")
+    digest.update(str(schem.blocks.dtype).encode())
+    digest.update(memoryview(np.ascontiguousarray(schem.blocks)).cast("B"))
+    return digest.hexdigest()
+
+
+class DuplicateGroups:
+    """Groups file paths by schematic fingerprint, keeping the first path of every group as its representative."""
+
+    def __init__(self):
+        self.groups: dict[str, list[str]] = {}
+
+    def add(self, filepath: str, schem: Schematic) -> str | None:
+        """Register a file. Returns the representative path if an identical schematic was added before."""
+        paths = self.groups.setdefault(fingerprint(schem), [])
+        paths.append(filepath)
+        return paths[0] if len(paths) > 1 else None
+
+    def duplicates(self) -> list[list[str]]:
+        return [paths for paths in self.groups.values() if len(paths) > 1]
+
+    def report(self) -> str:
+        duplicates = self.duplicates()
+        if not duplicates:
+            return ""
+        num_files = sum(len(paths) for paths in self.groups.values())
+        lines = [f"{num_files} files, {len(self.groups)} unique schematics, {len(duplicates)} duplicate groups:"]
+        for paths in duplicates:
+            lines.append("")
+            lines.append(f"{paths[0]}")
+            lines.extend(f"  = {path}" for path in paths[1:])
+        return "\n".join(lines)
@@ -0,0 +1,99 @@
+import fnmatch
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterator
+
+DEFAULT_INCLUDE = ("*.schem",)
+DISCOVERY_THREADS = 8
+
+
+class SchematicFinder:
+    """
+    Finds schematic files below a folder. Patterns are globs matched against the file or folder name and against
+    the path relative to the root (with / as separator), so "*.schem", "old_*" and "backup/*" all work.
+    include selects files, exclude skips files and whole folders. max_depth limits how many folders deep files
+    are searched: 0 only looks at the root folder itself, None has no limit.
+    """
+
+    def __init__(self, include: tuple[str, ...] | list[str] = DEFAULT_INCLUDE,
+                 exclude: tuple[str, ...] | list[str] = (), max_depth: int | None = None):
+        self.include = [pattern.lower() for pattern in include or DEFAULT_INCLUDE]
+        self.exclude = [pattern.lower() for pattern in exclude]
+        self.max_depth = max_depth
+
+    @staticmethod
+    def _matches(patterns: list[str], name: str, relative_path: str) -> bool:
+        name, relative_path = name.lower(), relative_path.lower()
+        return any(fnmatch.fnmatchcase(name, pattern) or fnmatch.fnmatchcase(relative_path, pattern)
+                   for pattern in patterns)
+
+    def scan(self, dirpath: str, relative_path: str, depth: int) -> tuple[list[str], list[tuple[str, str, int]]]:
+        """One os.scandir call: matching files and the subfolders to scan next as (path, relative path, depth)."""
+        files, subdirs = [], []
+        try:
+            with os.scandir(dirpath) as entries:
+                for entry in entries:
+                    entry_relative = f"{relative_path}/{entry.name}" if relative_path else entry.name
+                    if self._matches(self.exclude, entry.name, entry_relative):
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if self.max_depth is None or depth < self.max_depth:
+                                subdirs.append((entry.path, entry_relative, depth + 1))
+                        elif entry.is_file() and self._matches(self.include, entry.name, entry_relative):
+                            files.append(entry.path)
+                    except OSError:
+                        continue
+        except OSError:
+            pass  # unreadable or vanished folders are skipped, like os.walk does
+        files.sort()
+        subdirs.sort()
+        return files, subdirs
+
+    def walk(self, root_path: str) -> Iterator[str]:
+        """Depth-first generator over matching files, in the calling thread."""
+        stack = [(root_path, "", 0)]
+        while stack:
+            files, subdirs = self.scan(*stack.pop())
+            yield from files
+            stack.extend(reversed(subdirs))
+
+    def discover(self, root_path: str, threads: int = DISCOVERY_THREADS) -> Iterator[str]:
+        """
+        Generator over matching files that scans folders on several threads, so slow (network) file systems are
+        listed in parallel. Every folder's files are yielded as soon as it is listed, before the walk is finished;
+        the order between folders depends on which listing completes first.
+        """
+        if threads <= 1:
+            yield from self.walk(root_path)
+            return
+
+        executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="discovery")
+        try:
+            pending = {executor.submit(self.scan, root_path, "", 0)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    files, subdirs = future.result()
+                    pending.update(executor.submit(self.scan, *subdir) for subdir in subdirs)
+                    yield from files
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def worker_context() -> multiprocessing.context.BaseContext:
+    """
+    Start method for process pools fed by discover(): their workers start while the discovery threads run, and
+    forking a process with live threads can deadlock the child. forkserver (or spawn where it is missing) never
+    forks the threaded process itself.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def discover_schem_files(root_path: str, include: tuple[str, ...] | list[str] = DEFAULT_INCLUDE,
+                         exclude: tuple[str, ...] | list[str] = (), max_depth: int | None = None,
+                         threads: int = DISCOVERY_THREADS) -> Iterator[str]:
+    return SchematicFinder(include, exclude, max_depth).discover(root_path, threads)
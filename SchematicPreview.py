@@ -1,12 +1,16 @@
 import csv
-import math
 import os
+import shutil
 import sys
 import tkinter as tk
 from tkinter import filedialog, messagebox, scrolledtext
 
+import numpy as np
 from PIL import Image
-from nbtlib import File
+
+from Schematic import Schematic
+from SchematicDiscovery import DEFAULT_INCLUDE, discover_schem_files
+from SchematicStream import SLAB_HEIGHT, STREAMING_FILE_SIZE, iter_slabs, read_header
 
 
 def load_block_colors(path):
@@ -41,6 +45,11 @@ def load_block_colors(path):
 # Usage
 BLOCK_COLORS = load_block_colors("mc-materials.csv")
 
+# Output formats for previews and the contact sheet: "png" (RGBA), "png8" (indexed colors) or lossless "webp"
+IMAGE_FORMATS = {"png": ".png", "png8": ".png", "webp": ".webp"}
+DEFAULT_IMAGE_FORMAT = "png"
+CONTACT_SHEET = "combined"
+
 
 def darken_color(color: tuple[int, int, int], percent: float) -> tuple[int, int, int]:
     """Darken an RGBA color by a percentage (0.0 to 1.0)."""
@@ -53,77 +62,205 @@ def darken_color(color: tuple[int, int, int], percent: float) -> tuple[int, int,
     )
 
 
-def render_pixel(x, y, z, width, length, height, block_data, id_to_block, img, pixelcoord_x, pixelcoord_y,
-                 depth) -> bool:
-    idx = y * length * width + z * width + x
-    block_id = block_data[idx]
-    block_name = id_to_block[block_id] if block_id < len(id_to_block) else "minecraft:air"
+def build_color_lut(id_to_block: list) -> tuple[np.ndarray, np.ndarray]:
+    """Per palette id: is the block drawn (not air) and its base color. Ids outside the palette count as air."""
+    size = max(256, len(id_to_block))
+    solid = np.zeros(size, dtype=bool)
+    colors = np.zeros((size, 3), dtype=np.uint8)
+    for block_id, block_name in enumerate(id_to_block):
+        if block_name is not None and block_name != "minecraft:air" and block_name != "cave_air":
+            solid[block_id] = True
+            colors[block_id] = BLOCK_COLORS.get(block_name, (255, 0, 255))  # magenta fallback
+    return solid, colors
+
+
+def shade_colors(colors: np.ndarray, depth: np.ndarray) -> np.ndarray:
+    """Vectorized darken_color: darken each color by the square root of its depth (0.0 to 1.0)."""
+    colors = colors.astype(np.float64)
+    bright = (colors.max(axis=-1) + 1) * 0.5 > 1  # very bright blocks (like ice)
+    shift = np.where(bright, 0, 1)
+    factor = np.where(bright, .25, .5)
+    percent = (np.sqrt(depth) - shift) * factor
+    return np.maximum(0, colors * (1.0 - percent)[..., None]).astype(np.uint8)
+
+
+def first_hit(volume: np.ndarray, solid_mask: np.ndarray, axis: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """For every ray along axis: whether it hits a solid block, the index of the first hit and that block's id."""
+    hit = solid_mask.any(axis=axis)
+    first = solid_mask.argmax(axis=axis)
+    block_ids = np.take_along_axis(volume, np.expand_dims(first, axis), axis).squeeze(axis)
+    return hit, first, block_ids
+
 
-    if block_name != "minecraft:air" and block_name != "cave_air":
-        color: tuple[int, int, int] = BLOCK_COLORS.get(block_name, (255, 0, 255))  # magenta fallback
-        factor = 0.5
-        shift = 1
-        if (max(color) + shift) * factor > 1:  # very bright blocks (like ice)
-            shift = 0
-            factor = .25
-        color = darken_color(color, (math.sqrt(depth) - shift) * factor)
-        img.putpixel((pixelcoord_x, pixelcoord_y), color)
-        return True
-    return False
+def draw_view(pixels: np.ndarray, hit: np.ndarray, block_ids: np.ndarray, depth: np.ndarray, colors: np.ndarray,
+              left: int, top: int) -> None:
+    rows, cols = hit.shape
+    region = pixels[top:top + rows, left:left + cols]
+    region[hit, :3] = shade_colors(colors[block_ids[hit]], depth[hit])
+    region[hit, 3] = 255
 
 
 def render_schematic_side(filepath: str) -> Image.Image:
-    root = File.load(filepath, gzipped=True)  # loads Compound
-
-    width = root["Width"]
-    height = root["Height"]
-    length = root["Length"]
-
-    palette = root["Palette"]
-    block_data = root["BlockData"]  # ByteArray
-
-    # Invert palette: id -> block_name (without block states)
-    id_to_block = [None] * (max(palette.values()) + 1)
-    for block_name, idx in palette.items():
-        id_to_block[idx] = block_name.split("[")[0]  # remove block states
-
-    # Create an empty image for side view (Z horizontal, Y vertical)
-    img = Image.new("RGBA", (length + width + width + 2, max(width, length, height)), (0, 0, 0, 0))
-
-    # FRONT
-    for y in range(height):  # EACH ROW BOTTOM TO TOP
-        for z in range(length):  # EACH COLUMN LEFT TO RIGHT
-            for x in range(width):  # take first from this dimension
-                if render_pixel(x, y, z, width, length, height, block_data, id_to_block, img, z, height - 1 - y,
-                                x / width):
-                    break
-    # SIDE
-    for y in range(height):
-        for x in range(width):
-            for z in range(length):
-                if render_pixel(x, y, z, width, length, height, block_data, id_to_block, img, x + length + 1,
-                                height - 1 - y, z / length):
-                    break
-
-    # TOP
-
-    for x in range(width):  # EACH ROW
-        for z in range(length):  # EACH COLUMN IN ROW
-            for y in range(height - 1, 0, -1):  # EACH ROW BOTTOM TO TOP
-                if render_pixel(x, y, z, width, length, height, block_data, id_to_block, img, x + length + width + 2, z,
-                                (height - y) / height):
-                    break
-    return img
+    if os.path.getsize(filepath) > STREAMING_FILE_SIZE:
+        return render_schematic_streamed(filepath)
+    return render_schematic(Schematic.from_file(filepath))
+
+
+class ProjectionRenderer:
+    """
+    FRONT, SIDE and TOP views built up from Y-slabs, added bottom to top, so a streamed schematic never has to be
+    in memory as a whole. FRONT and SIDE rows of a slab are final once drawn; TOP keeps the highest hit per column.
+    """
+
+    def __init__(self, width: int, height: int, length: int):
+        self.width = width
+        self.height = height
+        self.length = length
+        self.palette = None
+        # Empty image for the three views: FRONT (Z horizontal, Y vertical), SIDE (X horizontal, Y vertical), TOP
+        self.pixels = np.zeros((max(width, length, height), length + width + width + 2, 4), dtype=np.uint8)
+        self.top_hit = np.zeros((length, width), dtype=bool)
+        self.top_y = np.zeros((length, width), dtype=np.int64)
+        self.top_colors = np.zeros((length, width, 3), dtype=np.uint8)
+
+    def add_slab(self, schem: Schematic) -> None:
+        """Draw a whole schematic or one of its slabs (schem.y_offset is the height of its lowest layer)."""
+        if schem.palette != self.palette:
+            self.palette = list(schem.palette)
+            # id -> block_name (without block states)
+            id_to_block = [block_name.split("[")[0] if block_name is not None else None for block_name in self.palette]
+            self.solid, self.colors = build_color_lut(id_to_block)
+
+        volume = schem.blocks  # indexed [y, z, x]
+        solid_mask = self.solid[volume]
+        top = self.height - schem.y_offset - schem.height  # image row of the slab's highest layer
+
+        # FRONT: first block along x, rows top to bottom
+        hit, first, block_ids = first_hit(volume, solid_mask, axis=2)
+        draw_view(self.pixels, hit[::-1], block_ids[::-1], first[::-1] / self.width, self.colors, 0, top)
+
+        # SIDE: first block along z
+        hit, first, block_ids = first_hit(volume, solid_mask, axis=1)
+        draw_view(self.pixels, hit[::-1], block_ids[::-1], first[::-1] / self.length, self.colors, self.length + 1, top)
+
+        # TOP: first block from the top of the slab down, y=0 is never drawn; higher slabs overwrite lower ones
+        num_layers = schem.height - 1 if schem.y_offset == 0 else schem.height
+        if num_layers > 0:
+            hit, first, block_ids = first_hit(volume[::-1][:num_layers], solid_mask[::-1][:num_layers], axis=0)
+            self.top_hit |= hit
+            self.top_y[hit] = schem.y_offset + schem.height - 1 - first[hit]
+            self.top_colors[hit] = self.colors[block_ids[hit]]
+
+    def image(self) -> Image.Image:
+        rows, cols = self.top_hit.shape
+        region = self.pixels[:rows, self.length + self.width + 2:self.length + self.width + 2 + cols]
+        depth = (self.height - self.top_y[self.top_hit]) / self.height
+        region[self.top_hit, :3] = shade_colors(self.top_colors[self.top_hit], depth)
+        region[self.top_hit, 3] = 255
+        return Image.fromarray(self.pixels, "RGBA")
+
+
+def render_schematic(schem: Schematic) -> Image.Image:
+    renderer = ProjectionRenderer(schem.width, schem.full_height, schem.length)
+    renderer.add_slab(schem)
+    return renderer.image()
+
+
+def render_schematic_streamed(filepath: str, slab_height: int = SLAB_HEIGHT) -> Image.Image:
+    """Same image as render_schematic, decoded slab by slab: peak memory is one slab instead of the whole file."""
+    header = read_header(filepath)
+    renderer = ProjectionRenderer(header.width, header.height, header.length)
+    for y, blocks in iter_slabs(filepath, header, slab_height):
+        renderer.add_slab(header.slab(blocks, y))
+    return renderer.image()
+
+
+# Isometric block sprite (4 x 4 pixels): face towards +z (lower left), towards +x (lower right) and top face.
+# Where faces at the same depth overlap, the higher face number is drawn.
+ISO_LEFT, ISO_RIGHT, ISO_TOP = 0, 1, 2
+ISO_SPRITE = {
+    ISO_TOP: ((0, 1), (0, 2), (1, 0), (1, 1), (1, 2), (1, 3)),
+    ISO_LEFT: ((2, 0), (2, 1), (3, 0), (3, 1)),
+    ISO_RIGHT: ((2, 2), (2, 3), (3, 2), (3, 3)),
+}
+# Face shading by normal: lit from above, the +x side darkest
+ISO_FACE_LIGHT = np.array([0.8, 0.6, 1.0])
+# Preview modes: the three orthographic views, one isometric view, or isometric views from all four sides
+PREVIEW_VIEWS = ("sides", "iso", "iso4")
+DEFAULT_PREVIEW_VIEW = "sides"
+
+
+def shifted(mask: np.ndarray, dy: int, dz: int, dx: int) -> np.ndarray:
+    """mask[y + dy, z + dz, x + dx] for every voxel (non-negative offsets), False beyond the schematic."""
+    height, length, width = mask.shape
+    result = np.zeros_like(mask)
+    result[:height - dy, :length - dz, :width - dx] = mask[dy:, dz:, dx:]
+    return result
+
+
+def draw_isometric(volume: np.ndarray, solid_mask: np.ndarray, colors: np.ndarray) -> np.ndarray:
+    """
+    Isometric RGBA pixels of a (y, z, x) volume seen from above +x/+z. Every exposed face is splatted with its
+    sprite pixels; a z-buffer keyed on x + y + z (nearer wins) decides which face a pixel shows.
+    """
+    height, length, width = volume.shape
+    image_height = width + length + 2 * height
+    image_width = 2 * (width + length)
+    # key = depth << 32 | face * number of ids + block id: ties are broken by face, never by palette order,
+    # and the z-buffer also holds what to draw
+    num_ids = len(colors)
+    zbuffer = np.full(image_height * image_width, -1, dtype=np.int64)
+
+    # the voxel at (x + 1, y + 1, z + 1) lands on the same pixels but nearer, so it hides the whole sprite
+    visible = solid_mask & ~shifted(solid_mask, 1, 1, 1)
+    for face, offset in ((ISO_TOP, (1, 0, 0)), (ISO_LEFT, (0, 1, 0)), (ISO_RIGHT, (0, 0, 1))):
+        ys, zs, xs = np.nonzero(visible & ~shifted(solid_mask, *offset))
+        keys = ((xs + ys + zs).astype(np.int64) << 32) | (face * num_ids + volume[ys, zs, xs].astype(np.int64))
+        rows = xs + zs + 2 * (height - 1 - ys)
+        cols = 2 * (xs - zs + length - 1)
+        for row_offset, col_offset in ISO_SPRITE[face]:
+            np.maximum.at(zbuffer, (rows + row_offset) * image_width + cols + col_offset, keys)
+
+    pixels = np.zeros((image_height * image_width, 4), dtype=np.uint8)
+    drawn = zbuffer >= 0
+    codes = zbuffer[drawn] & 0xFFFFFFFF
+    light = ISO_FACE_LIGHT[codes // num_ids]
+    pixels[drawn, :3] = (colors[codes % num_ids] * light[:, None]).astype(np.uint8)
+    pixels[drawn, 3] = 255
+    return pixels.reshape(image_height, image_width, 4)
+
+
+def render_isometric(schem: Schematic, directions: tuple[int, ...] = (0,)) -> Image.Image:
+    """
+    Isometric views side by side, one per direction (0 to 3, turned by 90 degrees each around the vertical axis).
+    All views share the decoded volume and one occupancy mask; turning them is a view, not a copy.
+    """
+    id_to_block = [block_name.split("[")[0] if block_name is not None else None for block_name in schem.palette]
+    solid, colors = build_color_lut(id_to_block)
+    solid_mask = solid[schem.blocks]
+
+    views = [draw_isometric(np.rot90(schem.blocks, direction, axes=(1, 2)),
+                            np.rot90(solid_mask, direction, axes=(1, 2)), colors)
+             for direction in directions]
+    pixels = np.zeros((max(view.shape[0] for view in views), sum(view.shape[1] + 2 for view in views) - 2, 4),
+                      dtype=np.uint8)
+    left = 0
+    for view in views:
+        pixels[:view.shape[0], left:left + view.shape[1]] = view
+        left += view.shape[1] + 2
+    return Image.fromarray(pixels, "RGBA")
+
+
+def render_preview(schem: Schematic, view: str = DEFAULT_PREVIEW_VIEW) -> Image.Image:
+    if view == "iso":
+        return render_isometric(schem)
+    if view == "iso4":
+        return render_isometric(schem, (0, 1, 2, 3))
+    return render_schematic(schem)
 
 
 def find_schem_files(root_path):
-    schem_files = []
-    for dirpath, dirnames, filenames in os.walk(root_path):
-        for filename in filenames:
-            if filename.lower().endswith('.schem'):
-                full_path = os.path.join(dirpath, filename)
-                schem_files.append(full_path)
-    return schem_files
+    return list(discover_schem_files(root_path))
 
 
 def resize_to_height(img: Image.Image, target_height: int = 100) -> Image.Image:
@@ -133,6 +270,46 @@ def resize_to_height(img: Image.Image, target_height: int = 100) -> Image.Image:
     return img.resize((new_width, target_height), Image.Resampling.NEAREST)
 
 
+def to_indexed(img: Image.Image) -> Image.Image:
+    """
+    Palette (P-mode) copy of a render with index 0 as the transparent background. Renders only use block colors
+    times their shading levels, so this is lossless as long as at most 255 colors are visible; larger sheets
+    are quantized to 256 colors.
+    """
+    pixels = np.asarray(img.convert("RGBA"))
+    opaque = pixels[..., 3] > 0
+    rgb = pixels[..., :3].astype(np.uint32)
+    keys = (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+    colors, color_index = np.unique(keys[opaque], return_inverse=True)
+    if len(colors) > 255:
+        return img.convert("RGBA").quantize(256, method=Image.Quantize.FASTOCTREE)
+
+    indices = np.zeros(opaque.shape, dtype=np.uint8)
+    indices[opaque] = color_index.ravel() + 1
+    palette = np.zeros((len(colors) + 1, 3), dtype=np.uint8)
+    palette[1:, 0] = colors >> 16
+    palette[1:, 1] = (colors >> 8) & 0xFF
+    palette[1:, 2] = colors & 0xFF
+    indexed = Image.fromarray(indices, "P")
+    indexed.putpalette(palette.ravel().tolist())
+    indexed.info["transparency"] = 0
+    return indexed
+
+
+def image_filename(path: str, image_format: str = DEFAULT_IMAGE_FORMAT) -> str:
+    """File name of the preview of a schematic (or of the contact sheet) in the given image format."""
+    return os.path.splitext(os.path.basename(path))[0] + IMAGE_FORMATS[image_format]
+
+
+def save_image(img: Image.Image, filepath: str, image_format: str = DEFAULT_IMAGE_FORMAT) -> None:
+    if image_format == "png8":
+        to_indexed(img).save(filepath, "PNG", optimize=True)
+    elif image_format == "webp":
+        img.save(filepath, "WEBP", lossless=True)
+    else:
+        img.save(filepath, "PNG")
+
+
 class RedirectText:
     """Redirect print to a Tkinter Text widget for live logging."""
 
@@ -150,34 +327,64 @@ class RedirectText:
         pass  # no-op for compatibility
 
 from CombineImages import combine_images_grid
+from SchematicDedup import DuplicateGroups
 
-def process_schematics(rootDir):
+def process_schematics(rootDir, include=DEFAULT_INCLUDE, exclude=(), max_depth=None,
+                       image_format=DEFAULT_IMAGE_FORMAT, view=DEFAULT_PREVIEW_VIEW):
     last_dir = os.path.basename(os.path.normpath(rootDir))
     output_path = last_dir
     os.makedirs(output_path, exist_ok=True)
 
-    files = find_schem_files(rootDir)
-    print(f"Found {len(files)} schematic files in {rootDir}\n", flush=True)
+    # files are rendered while the folder is still being searched
+    files = discover_schem_files(rootDir, include, exclude, max_depth)
+    print(f"Searching {rootDir} for schematic files\n", flush=True)
     output_files = []
+    num_files = 0
+    duplicates = DuplicateGroups()
+    rendered_files = {}
     for path in files:
+        num_files += 1
         try:
             print(f"Processing {path}...", flush=True)
-            img = render_schematic_side(path)
-            img = resize_to_height(img, 200)
-            filename = os.path.basename(path).replace(".schem", ".png")
+            filename = image_filename(path, image_format)
             filePath = os.path.join(output_path, filename)
-            img.save(filePath)
-            print(f"Saved image to {filePath}\n", flush=True)
+            if os.path.getsize(path) > STREAMING_FILE_SIZE:
+                # too large to decode as a whole: side views rendered slab by slab, not checked for duplicates
+                save_image(resize_to_height(render_schematic_streamed(path), 200), filePath, image_format)
+                print(f"Saved image to {filePath} (streamed)\n", flush=True)
+                output_files.append(filePath)
+                continue
+            schem = Schematic.from_file(path)
+            # previews are looked up by the group's first file, the first successful render of a group is reused
+            original = duplicates.add(path, schem) or path
+            if original in rendered_files:
+                # identical to a schematic rendered before, reuse its preview (same file name: nothing to copy)
+                if os.path.abspath(rendered_files[original]) != os.path.abspath(filePath):
+                    shutil.copyfile(rendered_files[original], filePath)
+                print(f"Identical to {original}, using image {filePath}\n", flush=True)
+            else:
+                img = render_preview(schem, view)
+                img = resize_to_height(img, 200)
+                save_image(img, filePath, image_format)
+                rendered_files[original] = filePath
+                print(f"Saved image to {filePath}\n", flush=True)
             output_files.append(filePath)
         except Exception as e:
             print(f"An error occurred while processing {path}: {e}\n", flush=True)
 
-    combined = combine_images_grid(output_files, 5)
-    combined.save(os.path.join(output_path, "combined.png"))
+    print(f"Found {num_files} schematic files in {rootDir}\n", flush=True)
+    report = duplicates.report()
+    if report:
+        with open(os.path.join(output_path, "duplicates.txt"), "w", encoding="utf-8") as file:
+            file.write(report + "\n")
+        print(report + "\n", flush=True)
+
+    combined = combine_images_grid(sorted(output_files), 5)
+    save_image(combined, os.path.join(output_path, image_filename(CONTACT_SHEET, image_format)), image_format)
     combined.show()
 
 
-def on_select_folder(text_widget):
+def on_select_folder(text_widget, image_format, view):
     rootDir = filedialog.askdirectory(title="Select Root Directory")
     if not rootDir:
         messagebox.showwarning("No folder selected", "Please select a folder.")
@@ -193,7 +400,7 @@ def on_select_folder(text_widget):
     sys.stdout = RedirectText(text_widget)
 
     try:
-        process_schematics(rootDir)
+        process_schematics(rootDir, image_format=image_format.get(), view=view.get())
         messagebox.showinfo("Done", f"Processed schematics from:\n{rootDir}")
     finally:
         sys.stdout = old_stdout  # Restore stdout
@@ -203,9 +410,19 @@ def main():
     window = tk.Tk()
     window.title("Schematic Renderer")
 
-    select_btn = tk.Button(window, text="Select Root Directory", command=lambda: on_select_folder(log_text))
+    select_btn = tk.Button(window, text="Select Root Directory",
+                           command=lambda: on_select_folder(log_text, image_format, view))
     select_btn.pack(padx=20, pady=(20, 5))
 
+    format_frame = tk.Frame(window)
+    format_frame.pack(padx=20, pady=5)
+    tk.Label(format_frame, text="Image format:").pack(side=tk.LEFT)
+    image_format = tk.StringVar(value=DEFAULT_IMAGE_FORMAT)
+    tk.OptionMenu(format_frame, image_format, *IMAGE_FORMATS).pack(side=tk.LEFT)
+    tk.Label(format_frame, text="View:").pack(side=tk.LEFT, padx=(10, 0))
+    view = tk.StringVar(value=DEFAULT_PREVIEW_VIEW)
+    tk.OptionMenu(format_frame, view, *PREVIEW_VIEWS).pack(side=tk.LEFT)
+
     log_text = scrolledtext.ScrolledText(window, state='disabled', width=80, height=20)
     log_text.pack(padx=20, pady=(5, 20))
 
@@ -0,0 +1,231 @@
+import gzip
+import os
+import shutil
+import tempfile
+from contextlib import ExitStack
+from typing import Callable, Iterator
+
+import nbtlib
+import numpy as np
+from nbtlib.tag import BYTE, INT, Base, read_numeric, read_string, write_numeric, write_string
+
+from SchemBlockReplacer import RANDOM_SEED, apply_mappings
+from Schematic import COLUMN_TAGS, Schematic, decode_varints, encode_varints, index_dtype
+
+SLAB_HEIGHT = 16
+READ_CHUNK_SIZE = 1 << 20
+# Files above this (compressed) size are streamed slab by slab instead of being decoded as a whole
+STREAMING_FILE_SIZE = 32 * 1024 ** 2
+
+
+class SchematicHeader:
+    """Every tag of a .schem file except BlockData, read without holding the voxels in memory."""
+
+    def __init__(self, root_name: str, tags: nbtlib.Compound):
+        self.root_name = root_name
+        self.tags = tags
+        self.width = int(tags["Width"])
+        self.height = int(tags["Height"])
+        self.length = int(tags["Length"])
+        palette_tag = tags["Palette"]
+        self.palette: list[str | None] = [None] * (max(palette_tag.values(), default=-1) + 1)
+        for block_name, block_id in palette_tag.items():
+            self.palette[block_id] = block_name
+
+    def slab(self, blocks: np.ndarray, y_offset: int) -> Schematic:
+        """Schematic for one slab, with its own copy of the palette."""
+        return Schematic(self.width, blocks.shape[0], self.length, list(self.palette), blocks,
+                         self.tags.get("BlockEntities"), self.metadata(), self.root_name, y_offset, self.height)
+
+    def metadata(self) -> nbtlib.Compound:
+        return nbtlib.Compound({key: value for key, value in self.tags.items() if key not in COLUMN_TAGS})
+
+
+def _read_root_name(fileobj) -> str:
+    if read_numeric(BYTE, fileobj) != nbtlib.Compound.tag_id:
+        raise TypeError("Non-Compound root tags are not supported")
+    return read_string(fileobj)
+
+
+def _is_block_data(tag_id: int, name: str) -> bool:
+    return name == "BlockData" and tag_id == nbtlib.ByteArray.tag_id
+
+
+def read_header(filepath: str) -> SchematicHeader:
+    """One pass over the gzip stream, BlockData is skipped chunk by chunk."""
+    tags = nbtlib.Compound()
+    with gzip.open(filepath, "rb") as fileobj:
+        root_name = _read_root_name(fileobj)
+        tag_id = read_numeric(BYTE, fileobj)
+        while tag_id != 0:
+            name = read_string(fileobj)
+            if _is_block_data(tag_id, name):
+                remaining = read_numeric(INT, fileobj)
+                while remaining > 0:
+                    remaining -= len(fileobj.read(min(remaining, READ_CHUNK_SIZE)))
+            else:
+                tags[name] = Base.all_tags[tag_id].parse(fileobj, "big")
+            tag_id = read_numeric(BYTE, fileobj)
+    return SchematicHeader(root_name, tags)
+
+
+def iter_block_data(filepath: str, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[np.ndarray]:
+    """Raw BlockData bytes in chunks, straight from the gzip stream."""
+    with gzip.open(filepath, "rb") as fileobj:
+        _read_root_name(fileobj)
+        tag_id = read_numeric(BYTE, fileobj)
+        while tag_id != 0:
+            name = read_string(fileobj)
+            if _is_block_data(tag_id, name):
+                remaining = read_numeric(INT, fileobj)
+                while remaining > 0:
+                    chunk = fileobj.read(min(remaining, chunk_size))
+                    if not chunk:
+                        raise EOFError(f"BlockData of {filepath} ends early")
+                    remaining -= len(chunk)
+                    yield np.frombuffer(chunk, dtype=np.uint8)
+                return
+            Base.all_tags[tag_id].parse(fileobj, "big")
+            tag_id = read_numeric(BYTE, fileobj)
+    raise ValueError(f"{filepath} has no BlockData")
+
+
+def iter_slabs(filepath: str, header: SchematicHeader, slab_height: int = SLAB_HEIGHT) -> Iterator[tuple[int, np.ndarray]]:
+    """
+    Decode BlockData in Y-slabs: yields (y of the lowest layer, (layers, length, width) index array) bottom to top.
+    Varints split across chunk boundaries are carried over, so only about one slab is decoded at a time.
+    """
+    layer_size = header.length * header.width
+    slab_size = slab_height * layer_size
+    dtype = index_dtype(len(header.palette))
+    pending: list[np.ndarray] = []
+    num_pending = 0
+    carry = np.empty(0, dtype=np.uint8)
+    y = 0
+
+    for chunk in iter_block_data(filepath, max(slab_size, READ_CHUNK_SIZE)):
+        data = np.concatenate((carry, chunk)) if carry.size else chunk
+        # a varint is at most 5 bytes long, so the last complete one ends within the last 5 bytes
+        tail = np.flatnonzero(data[-5:] < 0x80)
+        end = len(data) - min(len(data), 5) + tail[-1] + 1 if tail.size else 0
+        carry = data[end:].copy()
+        values = decode_varints(data[:end])
+        pending.append(values)
+        num_pending += len(values)
+
+        while num_pending >= slab_size and y + slab_height <= header.height:
+            values = np.concatenate(pending) if len(pending) > 1 else pending[0]
+            slab = values[:slab_size].astype(dtype)
+            pending = [values[slab_size:]]
+            num_pending -= slab_size
+            yield y, slab.reshape(slab_height, header.length, header.width)
+            y += slab_height
+
+    if y < header.height:
+        remaining_layers = header.height - y
+        values = np.concatenate(pending) if len(pending) > 1 else pending[0]
+        if len(values) < remaining_layers * layer_size:
+            raise ValueError(f"BlockData of {filepath} is shorter than {header.width}x{header.height}x{header.length}")
+        yield y, values[:remaining_layers * layer_size].astype(dtype).reshape(remaining_layers, header.length,
+                                                                            header.width)
+
+
+class StreamedWriter:
+    """
+    Writes a .schem from slabs that all went through the same palette edits, added bottom to top. The encoded
+    BlockData is spooled to an uncompressed temporary file first, since its length has to be written before the data.
+    Closing without finish() discards the spool and leaves filepath untouched.
+    """
+
+    def __init__(self, filepath: str, header: SchematicHeader):
+        self.filepath = filepath
+        self.header = header
+        self.spool = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(filepath)))
+        self.palette_tag = None
+        self.remap = None
+        self.last_slab = None
+
+    def add(self, slab: Schematic) -> None:
+        if self.palette_tag is None:
+            self.palette_tag, self.remap = slab.resolve_palette()
+        blocks = slab.blocks.ravel()
+        if self.remap is not None:
+            blocks = self.remap[blocks]
+        self.spool.write(encode_varints(blocks).tobytes())
+        self.last_slab = slab
+
+    def finish(self) -> None:
+        slab, header = self.last_slab, self.header
+        if slab is None:
+            raise ValueError(f"{self.filepath}: no slabs to write")
+        block_data_length = self.spool.tell()
+        self.spool.seek(0)
+
+        tags = nbtlib.Compound(slab.metadata)
+        tags["Width"] = nbtlib.Short(header.width)
+        tags["Height"] = nbtlib.Short(header.height)
+        tags["Length"] = nbtlib.Short(header.length)
+        tags["PaletteMax"] = nbtlib.Int(len(self.palette_tag))
+        tags["Palette"] = nbtlib.Compound({name: nbtlib.Int(block_id) for name, block_id in self.palette_tag.items()})
+
+        with gzip.open(self.filepath, "wb") as fileobj:
+            write_numeric(BYTE, nbtlib.Compound.tag_id, fileobj)
+            write_string(header.root_name, fileobj)
+            for name, tag in tags.items():
+                write_numeric(BYTE, tag.tag_id, fileobj)
+                write_string(name, fileobj)
+                tag.write(fileobj, "big")
+            write_numeric(BYTE, nbtlib.ByteArray.tag_id, fileobj)
+            write_string("BlockData", fileobj)
+            write_numeric(INT, block_data_length, fileobj)
+            shutil.copyfileobj(self.spool, fileobj, READ_CHUNK_SIZE)
+            if slab.block_entities:
+                write_numeric(BYTE, slab.block_entities.tag_id, fileobj)
+                write_string("BlockEntities", fileobj)
+                slab.block_entities.write(fileobj, "big")
+            write_numeric(BYTE, 0, fileobj)
+
+    def close(self) -> None:
+        self.spool.close()
+
+    def __enter__(self) -> "StreamedWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def stream_variants(source: str, header: SchematicHeader, variants: list[tuple[dict, str, Callable | None]],
+                    seed: int = RANDOM_SEED, slab_height: int = SLAB_HEIGHT,
+                    on_slab: Callable | None = None) -> list[list[str]]:
+    """
+    apply_mappings for schematics too large for memory, for several (mappings, target path, on_slab) variants in
+    one decode. Every slab is decoded once and passed unchanged to on_slab(slab), e.g. to render the original;
+    each variant gets its own copy of the slab (and of the original palette, so palette edits come out the same
+    for all slabs), which goes to the variant's spool and its own on_slab.
+    Returns the messages of apply_mappings per variant (identical for every slab).
+    """
+    messages: list[list[str]] = [[] for _ in variants]
+    with ExitStack() as stack:
+        writers = [stack.enter_context(StreamedWriter(target, header)) for _, target, _ in variants]
+        for y, blocks in iter_slabs(source, header, slab_height):
+            slab = header.slab(blocks, y)
+            if on_slab is not None:
+                on_slab(slab)
+            for (mappings, _, on_variant_slab), writer, variant_messages in zip(variants, writers, messages):
+                variant = slab.copy()
+                slab_messages = apply_mappings(variant, mappings, seed=seed)
+                if not variant_messages:
+                    variant_messages.extend(slab_messages)
+                if on_variant_slab is not None:
+                    on_variant_slab(variant)
+                writer.add(variant)
+        for writer in writers:
+            writer.finish()
+    return messages
+
+
+def stream_replace(source: str, target: str, mappings: dict, seed: int = RANDOM_SEED,
+                   slab_height: int = SLAB_HEIGHT, on_slab: Callable | None = None) -> list[str]:
+    """stream_variants with a single variant; on_slab(slab) is called for every replaced slab."""
+    return stream_variants(source, read_header(source), [(mappings, target, on_slab)], seed, slab_height)[0]
@@ -0,0 +1,291 @@
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+from CombineImages import combine_images_grid
+from MappingRules import compile_mappings, load_mapping_file
+from SchemBlockReplacer import RANDOM_SEED, apply_mappings
+from Schematic import Schematic
+from SchematicPreview import (CONTACT_SHEET, DEFAULT_IMAGE_FORMAT, DEFAULT_PREVIEW_VIEW, IMAGE_FORMATS, PREVIEW_VIEWS,
+                              ProjectionRenderer, find_schem_files, image_filename, render_preview,
+                              resize_to_height, save_image)
+from SchematicStream import STREAMING_FILE_SIZE, read_header, stream_variants
+
+DEBOUNCE_SECONDS = 2.0
+POLL_INTERVAL_SECONDS = 1.0
+
+# inotify(7) event masks
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def is_schem_file(path: str) -> bool:
+    return path.lower().endswith(".schem")
+
+
+class InotifyWatcher:
+    """Recursive watch of a folder through Linux inotify, new subfolders are picked up as they appear."""
+
+    def __init__(self, root_path: str):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.root_path = root_path
+        self.watches: dict[int, str] = {}
+        self.add_tree(root_path)
+
+    def add_tree(self, path: str) -> set[str]:
+        """Watch path and all folders below it, returns the .schem files already in there."""
+        found = set()
+        for dirpath, dirnames, filenames in os.walk(path):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirpath), WATCH_MASK)
+            if wd >= 0:
+                self.watches[wd] = dirpath
+            found.update(os.path.join(dirpath, filename) for filename in filenames if is_schem_file(filename))
+        return found
+
+    def changes(self, timeout: float) -> tuple[set[str], set[str]]:
+        """Wait up to timeout seconds for events, returns (changed, deleted) .schem paths."""
+        changed, deleted = set(), set()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return changed, deleted
+
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + name_length].rstrip(b"\0").decode(errors="replace")
+            offset += name_length
+
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, treat every file as changed
+                changed.update(find_schem_files(self.root_path))
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            directory = self.watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changed.update(self.add_tree(path))
+                continue
+            if not is_schem_file(path):
+                continue
+            if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                changed.add(path)
+                deleted.discard(path)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                deleted.add(path)
+                changed.discard(path)
+        return changed, deleted
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Fallback for systems without inotify: compares size and modification time of all .schem files."""
+
+    def __init__(self, root_path: str, interval: float = POLL_INTERVAL_SECONDS):
+        self.root_path = root_path
+        self.interval = interval
+        self.snapshot = self.scan()
+
+    def scan(self) -> dict[str, tuple[int, int]]:
+        snapshot = {}
+        for path in find_schem_files(self.root_path):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def changes(self, timeout: float) -> tuple[set[str], set[str]]:
+        time.sleep(min(timeout, self.interval))
+        snapshot = self.scan()
+        changed = {path for path, state in snapshot.items() if self.snapshot.get(path) != state}
+        deleted = set(self.snapshot) - set(snapshot)
+        self.snapshot = snapshot
+        return changed, deleted
+
+    def close(self) -> None:
+        pass
+
+
+def create_watcher(root_path: str, polling: bool = False):
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(root_path)
+        except (OSError, AttributeError) as e:
+            print(f"inotify not available ({e}), polling instead", flush=True)
+    return PollingWatcher(root_path)
+
+
+class SchematicWatcher:
+    """
+    Keeps previews, the contact sheet and optionally a replaced copy of a folder of schematics up to date.
+    Changes are collected until the folder was quiet for debounce seconds and then processed as one batch.
+    Block colors and the compiled mapping preset stay loaded for the whole session.
+    """
+
+    def __init__(self, watch_path: str, preview_path: str, preset_path: str | None = None,
+                 output_path: str | None = None, seed: int = RANDOM_SEED, debounce: float = DEBOUNCE_SECONDS,
+                 polling: bool = False, image_format: str = DEFAULT_IMAGE_FORMAT, view: str = DEFAULT_PREVIEW_VIEW):
+        self.watch_path = watch_path
+        self.preview_path = preview_path
+        self.output_path = output_path
+        self.seed = seed
+        self.debounce = debounce
+        self.polling = polling
+        self.image_format = image_format
+        self.view = view
+        self.mappings = compile_mappings(load_mapping_file(preset_path)) if preset_path else None
+        os.makedirs(preview_path, exist_ok=True)
+
+    def preview_file(self, path: str) -> str:
+        return os.path.join(self.preview_path, image_filename(path, self.image_format))
+
+    def output_file(self, path: str) -> str:
+        return os.path.join(self.output_path, os.path.relpath(path, self.watch_path))
+
+    def own_output_removed(self, paths: set[str]) -> set[str]:
+        """paths without our own output, which may lie inside the watched folder and must never be processed."""
+        if not self.output_path:
+            return paths
+        output_root = os.path.abspath(self.output_path) + os.sep
+        return {path for path in paths if not os.path.abspath(path).startswith(output_root)}
+
+    def outdated_files(self) -> set[str]:
+        """Files changed while the watcher was not running: no preview yet or one older than the file."""
+        outdated = set()
+        for path in self.own_output_removed(set(find_schem_files(self.watch_path))):
+            preview = self.preview_file(path)
+            if not os.path.exists(preview) or os.path.getmtime(preview) < os.path.getmtime(path):
+                outdated.add(path)
+        return outdated
+
+    def process(self, changed: set[str], deleted: set[str]) -> None:
+        for path in sorted(changed):
+            try:
+                if os.path.getsize(path) > STREAMING_FILE_SIZE:
+                    self.process_streamed(path)
+                    continue
+                print(f"Processing {path}...", flush=True)
+                schem = Schematic.from_file(path)
+                img = resize_to_height(render_preview(schem, self.view), 200)
+                save_image(img, self.preview_file(path), self.image_format)
+                if self.mappings and self.output_path:
+                    for message in apply_mappings(schem, self.mappings, seed=self.seed):
+                        print(f"  {message}", flush=True)
+                    output_file = self.output_file(path)
+                    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+                    schem.to_file(output_file)
+            except Exception as e:
+                print(f"An error occurred while processing {path}: {e}", flush=True)
+
+        for path in sorted(deleted):
+            print(f"Removed {path}", flush=True)
+            for stale_file in (self.preview_file(path), self.output_file(path) if self.output_path else None):
+                if stale_file and os.path.exists(stale_file):
+                    os.remove(stale_file)
+
+        self.update_contact_sheet()
+
+    def process_streamed(self, path: str) -> None:
+        """
+        process for files too large to decode as a whole: one slab by slab pass renders the side views and,
+        with a preset, writes the replaced copy.
+        """
+        print(f"Processing {path} (streamed)...", flush=True)
+        header = read_header(path)
+        renderer = ProjectionRenderer(header.width, header.height, header.length)
+        variants = []
+        if self.mappings and self.output_path:
+            output_file = self.output_file(path)
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+            variants.append((self.mappings, output_file, None))
+        messages = stream_variants(path, header, variants, self.seed, on_slab=renderer.add_slab)
+        save_image(resize_to_height(renderer.image(), 200), self.preview_file(path), self.image_format)
+        for message in messages[0] if messages else []:
+            print(f"  {message}", flush=True)
+
+    def update_contact_sheet(self) -> None:
+        contact_sheet = image_filename(CONTACT_SHEET, self.image_format)
+        extension = IMAGE_FORMATS[self.image_format]
+        previews = sorted(os.path.join(self.preview_path, filename) for filename in os.listdir(self.preview_path)
+                          if filename.endswith(extension) and filename != contact_sheet)
+        if previews:
+            save_image(combine_images_grid(previews, 5), os.path.join(self.preview_path, contact_sheet),
+                       self.image_format)
+            print(f"Updated {contact_sheet} with {len(previews)} previews\n", flush=True)
+
+    def run(self) -> None:
+        watcher = create_watcher(self.watch_path, self.polling)
+        print(f"Watching {self.watch_path} with {type(watcher).__name__}", flush=True)
+
+        pending_changed, pending_deleted = self.outdated_files(), set()
+        last_event = 0.0
+        try:
+            while True:
+                changed, deleted = watcher.changes(self.debounce)
+                changed, deleted = self.own_output_removed(changed), self.own_output_removed(deleted)
+                if changed or deleted:
+                    pending_changed = (pending_changed - deleted) | changed
+                    pending_deleted = (pending_deleted - changed) | deleted
+                    last_event = time.monotonic()
+                    continue
+                if (pending_changed or pending_deleted) and time.monotonic() - last_event >= self.debounce:
+                    self.process(pending_changed, pending_deleted)
+                    pending_changed, pending_deleted = set(), set()
+        except KeyboardInterrupt:
+            print("Stopped watching", flush=True)
+        finally:
+            watcher.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch a folder and keep schematic previews up to date.")
+    parser.add_argument("folder", help="folder with .schem files, including subfolders")
+    parser.add_argument("--previews", help="folder for previews and combined.png (default: name of the watched folder)")
+    parser.add_argument("--preset", help="mapping file saved with 'Save settings' to apply to every changed file")
+    parser.add_argument("--output", help="folder the replaced copies are written to, mirroring the watched folder")
+    parser.add_argument("--seed", type=int, default=RANDOM_SEED, help="seed for weighted replacements")
+    parser.add_argument("--debounce", type=float, default=DEBOUNCE_SECONDS,
+                        help="seconds without changes before a batch is processed")
+    parser.add_argument("--poll", action="store_true", help="poll the folder instead of using inotify")
+    parser.add_argument("--format", choices=IMAGE_FORMATS, default=DEFAULT_IMAGE_FORMAT,
+                        help="image format of previews and combined sheet (png8: indexed colors, webp: lossless)")
+    parser.add_argument("--view", choices=PREVIEW_VIEWS, default=DEFAULT_PREVIEW_VIEW,
+                        help="preview mode: three side views, one isometric view or isometric views from four sides")
+    args = parser.parse_args()
+
+    if args.preset and not args.output:
+        parser.error("--preset needs --output")
+    preview_path = args.previews or os.path.basename(os.path.normpath(args.folder))
+    SchematicWatcher(args.folder, preview_path, args.preset, args.output, args.seed, args.debounce, args.poll,
+                     args.format, args.view).run()
+
+
+if __name__ == "__main__":
+    main()